@@ -4,6 +4,7 @@
 #
 # Version: 1.0 (9/1/2025) Initial release
 #       Requires SharpCap 4.1 or higher
+#       Uses numpy for pixel statistics when available, otherwise SharpCap's CutROI / GetStats (e.g. IronPython)
 #
 # To Do: 
     # Organize captures into folders
@@ -12,8 +13,12 @@
     # ? Automated sun finding? should be possible to slew back and forth to maximize the ROI mean brightness, as long as somewhat close to the sun
 # *****************************************************************************************************
 
-import time, os, sys, math, clr, io, re
+import time, os, sys, math, clr, io, re, threading
 from pathlib import Path
+try:
+    import numpy as np      # optional, not available under IronPython. Without it SharpCap's GetStats is used
+except ImportError:
+    np = None
 clr.AddReference("System.Drawing")
 clr.AddReference("System.Windows.Forms")
 clr.AddReference("System.Threading.Tasks")
@@ -45,12 +50,85 @@ MainForm = None
 FIND_RATE = 64
 CENTER_RATE = 16
 REPOSITION_RATE = 32
+EDGE_WINDOW = 10                # edge search window is EDGE_WINDOW x EDGE_WINDOW pixels along top of frame
+SETTING_RE = re.compile(r"([a-zA-Z]+)=([0-9.a-zA-Z]+)")     # key=value line in settings file
+FPS_RE = re.compile(r"([0-9]+[.,]?[0-9]*)\s*fps")             # frame rate in camera status text
+# settings file key -> (SHGForm attribute, value conversion). LimbThreshold is handled separately
+SETTING_MAP = {
+    "NumCycles": ("NumCycles", int),
+    "SunWidth": ("SunWidth", int),
+    "CycleSleep": ("CycleSleep", lambda v: float(reformatNum(v))),
+    "SlewPad": ("SlewPad", lambda v: float(reformatNum(v))),
+    "Bidirectional": ("Bidirectional", lambda v: v == "True"),
+    "BumpSwap": ("BumpSwap", lambda v: v == "True"),
+    "BumpRate": ("BumpRate", int),
+    "AxisToMove": ("AxisToMove", int),
+}
 ### END GOBALS
 
 # not sure why localization doesn't seem to work for number formatting, convert commas to decimal point
 def reformatNum(str):
     return str.replace(',', '.')
 
+# copy MONO16 frame pixels into a (height, width) numpy array
+# None if numpy isn't available or the frame data isn't exactly height x width 16 bit pixels, so callers
+# fall back to SharpCap's own statistics
+def frame_to_np(frame):
+    if np is None:
+        return None
+    try:
+        data = bytes(frame.AsByteArray())
+        height, width = frame.Height, frame.Width
+    except AttributeError:
+        return None
+    if (height <= 0 or width <= 0 or len(data) != height * width * 2):
+        return None
+    return np.frombuffer(data, dtype=np.uint16).reshape(height, width)
+
+# find the first and last EDGE_WINDOW wide windows across the rows of top whose stddev is at or above threshold
+# returns (startEdge, endEdge, stddev of all of top), edges are -1 if no window is above threshold
+def find_edges(top, threshold):
+    colSum = top.sum(axis=0, dtype=np.float64)
+    colSumSq = np.einsum('ij,ij->j', top, top, dtype=np.float64)
+    mean = colSum.sum() / top.size
+    topStd = math.sqrt(max(colSumSq.sum() / top.size - mean*mean, 0))
+
+    n = top.shape[0] * EDGE_WINDOW
+    box = np.ones(EDGE_WINDOW)
+    winMean = np.convolve(colSum, box, mode='valid') / n
+    winMeanSq = np.convolve(colSumSq, box, mode='valid') / n
+    winStd = np.sqrt(np.maximum(winMeanSq - winMean*winMean, 0))
+    idx = np.flatnonzero(winStd >= threshold)
+    if not idx.size:
+        return -1, -1, topStd
+    return int(idx[0]), int(idx[-1]), topStd
+
+# same search without numpy, scanning 10x10 CutROIs of frame inwards from each side with GetStats
+# returns (startEdge, endEdge, stddev of whole frame), skips the scan if the whole frame is below threshold
+def find_edges_managed(frame, threshold, imgWidth):
+    frameStd = frame.GetStats().Item2
+    if (frameStd < threshold):
+        return -1, -1, frameStd
+
+    # scan from left to right to find leading edge of 10 pixel wide window transition
+    startEdge = -1
+    x = 0
+    while (startEdge<0 and x<=imgWidth):
+        if (frame.CutROI(Rectangle(x, 0, EDGE_WINDOW, EDGE_WINDOW)).GetStats().Item2 < threshold):
+            x += 1
+        else:
+            startEdge = x
+
+    # scan from right to left to find trailing edge of 10 pixel wide window transition
+    endEdge = -1
+    x = imgWidth
+    while (endEdge<0 and x>=0):
+        if (frame.CutROI(Rectangle(x, 0, EDGE_WINDOW, EDGE_WINDOW)).GetStats().Item2 < threshold):
+            x -= 1
+        else:
+            endEdge = x
+    return startEdge, endEdge, frameStd
+
 class SHGForm(Form):
 
     # User input vars
@@ -67,10 +145,10 @@ class SHGForm(Form):
     EdgePassed = False
     PositiveSignal = False
     LimbThreshold = 100
-    FrameInterval = 10         # assess for transition every 10th frame
-    FrameCount = FrameInterval
+    SearchFrameInterval = 20   # assess for positive transition every 20th frame
+    EdgeFrameInterval = 5      # once sun seen, assess for limb transition every 5th frame
+    FrameCount = SearchFrameInterval
     FrameVal = 0
-    FrameHandlingDone = False
     SunWidth = 2300
     SunDecenter = 0
     
@@ -87,8 +165,11 @@ class SHGForm(Form):
 
     # SharpCap objects
     SavedCoords = None
+    LastMove = None         # (axis, rate) of last MoveAxis command sent to the mount
     
     def __init__(self):
+        self.FrameHandlingDone = threading.Event()      # set by measureSunFramehandler when done
+        self.EdgePassedEvent = threading.Event()        # set by acquireFramehandler when limb passed
         self.SuspendLayout()
         self.getSettings();
         self.InitializeComponent()
@@ -114,34 +195,21 @@ class SHGForm(Form):
                     items = config.split('\n')     # split into lines
                     # parse lines
                     for item in items:
-                        m = re.search("([a-zA-Z]+)=([0-9.a-zA-Z]+)", item)
+                        m = SETTING_RE.match(item)
                         if not m:
                             SharpCap.ShowNotification(f"Ignored invalid settings keyword {item}", NotificationStatus.Warning)
                             continue
                         key = m.group(1)
                         value = m.group(2)
-                        if key == "NumCycles":
-                            self.NumCycles=int(value)
-                        elif key == "SunWidth":
-                            self.SunWidth = int(value)
-                        elif key == "CycleSleep":
-                            self.CycleSleep=float(reformatNum(value))
-                        elif key == "SlewPad":
-                            self.SlewPad = float(reformatNum(value))
-                        elif key == "LimbThreshold":
+                        if key == "LimbThreshold":
                             n = float(reformatNum(value))
                             if (n >= 1):
                                 self.LimbThreshold = n          # for backward compatibility with old brightness factor settings
                             else:
                                 self.LimbThreshold = DEFAULT_THRESHOLD
-                        elif key == "Bidirectional":
-                            self.Bidirectional = (value == "True")
-                        elif key == "BumpSwap":
-                            self.BumpSwap = (value == "True")
-                        elif key == "BumpRate":
-                            self.BumpRate = int(value)
-                        elif key == "AxisToMove":
-                            self.AxisToMove = int(value)
+                        elif key in SETTING_MAP:
+                            attr, convert = SETTING_MAP[key]
+                            setattr(self, attr, convert(value))
                     f.close()
             except:
                 SharpCap.ShowNotification("Error reading settings file", NotificationStatus.Error)
@@ -311,69 +379,86 @@ class SHGForm(Form):
             pass
             
     ######################### SHGForm action handlers #########################
+    # send MoveAxis command to the mount, skipping a move identical to the last command sent
+    # stops are always sent, a repeated stop only happens when something else has the mount moving
+    def moveAxis(self, axis, rate):
+        if (rate != 0 and self.LastMove == (axis, rate)):
+            return
+        SharpCap.Mounts.SelectedMount.MoveAxis(axis, rate)
+        self.LastMove = (axis, rate)
+
     # send command to stop movement and resume tracking, wait until mount actually stops
     def stopSlew(self):
-        SharpCap.Mounts.SelectedMount.MoveAxis(self.AxisToMove, 0)
+        self.moveAxis(self.AxisToMove, 0)
         while SharpCap.Mounts.SelectedMount.Slewing:
             time.sleep(0.25)
             
     # find the frame rate
+    # use the rate shown in the camera status if there is one, otherwise count frames for 1 second
     def getCamFramerate(self):
+        status = SharpCap.SelectedCamera.LatestStatus
+        m = FPS_RE.search(status.NotificationText or "") if status else None
+        if m:
+            fps = float(reformatNum(m.group(1)))      # convert to decimal representation
+            if (fps > 0):
+                return fps
         startFrame = SharpCap.SelectedCamera.GetStatus(False).CapturedFrames
         time.sleep(1)   # measure for 1 second
         endFrame = SharpCap.SelectedCamera.GetStatus(False).CapturedFrames 
         fps = (endFrame - startFrame)
-        # status=SharpCap.SelectedCamera.LatestStatus.NotificationText
-        # fpsStr=status[status.find(", ")+2:status.find(" fps")]
-        # fps=float(fpsStr.replace(',', '.'))      # convert to decimal representation
         return fps
     
     # framehandler for measuring width - grabs a single frame and looks for first and last transitions, calculates center
     # SharpCap blocks until framehandler returns
     def measureSunFramehandler(self, sender, args):
         frame0 = args.Frame
-        # if stddev across whole image below threshold, sun is not in frame
-        if (frame0.GetStats().Item2 < self.LimbThreshold):
+        # leading / trailing edges are the first / last 10x10 windows along the top of the frame with stddev
+        # above threshold. The stddev of the same strip (whole frame without numpy) checks the sun is in frame
+        pixels = frame_to_np(frame0)
+        if pixels is None:
+            imgWidth = SharpCap.SelectedCamera.ROI.Width - EDGE_WINDOW
+            startEdge, endEdge, frameStd = find_edges_managed(frame0, self.LimbThreshold, imgWidth)
+        else:
+            top = pixels[:EDGE_WINDOW, :]
+            imgWidth = top.shape[1] - EDGE_WINDOW
+            startEdge, endEdge, frameStd = find_edges(top, self.LimbThreshold)
+        if (frameStd < self.LimbThreshold):
             SharpCap.ShowNotification("*** Sun is not in frame ***", NotificationStatus.Error)
-            self.FrameHandlingDone = True
+            self.FrameHandlingDone.set()
             return
 
-        # scan a 10x100 ROI from left to right to find leading edge of 10 pixel wide window transition
-        imgWidth = SharpCap.SelectedCamera.ROI.Width - 10
-        startEdge = -1
-        x = 0
-        while (startEdge<0 and x<imgWidth):
-            cutout = frame0.CutROI(Rectangle(x, 0, 10, 10))
-            if (cutout.GetStats().Item2 < self.LimbThreshold):
-                x += 1
-            else:
-                startEdge = x
-
-        # scan a 10x100 ROI from right to left to find trailing edge of 10 pixel wide window transition
-        endEdge = -1
-        x = imgWidth
-        while (endEdge<0 and x>=0):
-            cutout = frame0.CutROI(Rectangle(x, 0, 10, 10))
-            if (cutout.GetStats().Item2 < self.LimbThreshold):
-                x -= 1
-            else:
-                endEdge = x
-        
-        if (startEdge > 0 and endEdge > 0):
+        # same lower limit as doSunWidthChange - a single limb in frame gives a width of a few pixels, which
+        # would make the slew rate absurdly fast
+        if (startEdge > 0 and endEdge > 0 and endEdge - startEdge > 100):
             self.SunWidth = endEdge - startEdge
             self.SunDecenter = (self.SunWidth/2 + startEdge) - (imgWidth+10)/2
         else:
-            SharpCap.ShowNotification("*** Sun is not in frame ***", NotificationStatus.Error)
+            if (startEdge > 0 and endEdge > 0):
+                SharpCap.ShowNotification(f"*** Measured sun width {endEdge - startEdge} too small, sun only partly in frame? Using default width ***", NotificationStatus.Error)
+            else:
+                SharpCap.ShowNotification("*** Sun is not in frame ***", NotificationStatus.Error)
             self.SunWidth = DEFAULT_SUN_WIDTH
-            self.sunDecenter = 0
-        self.FrameHandlingDone = True
+            self.SunDecenter = 0
+        self.FrameHandlingDone.set()
 
-    # Framehandler to detect negative limb transition, check every FrameInterval captured frames
+    # Framehandler to detect negative limb transition, check every SearchFrameInterval captured frames until
+    # sun seen, then every EdgeFrameInterval frames to catch the limb promptly
     # stddev < 100 seems to work pretty well
     def acquireFramehandler(self, sender, args):
         if (self.FrameCount == 0):
             try:
-                val = args.Frame.GetStats().Item2   # std dev
+                # std dev over 100x100 box centered on this frame, clipped to the frame if the frame is smaller
+                # only the box is cut out and converted, from sum and sum of squares without temporary arrays
+                frame = args.Frame
+                w = min(frame.Width, 100)
+                h = min(frame.Height, 100)
+                cutout = frame.CutROI(Rectangle((frame.Width - w) // 2, (frame.Height - h) // 2, w, h))
+                roi = frame_to_np(cutout)
+                if roi is None:
+                    val = cutout.GetStats().Item2
+                else:
+                    mean = roi.sum(dtype=np.float64) / roi.size
+                    val = math.sqrt(max(np.einsum('ij,ij->', roi, roi, dtype=np.float64) / roi.size - mean*mean, 0))
                 
                 # If still waiting positive transition, check if average is above limb threshold
                 if (not self.PositiveSignal):
@@ -381,8 +466,11 @@ class SHGForm(Form):
                 # Otherwise check if average is below limb threshold
                 elif (not self.EdgePassed):
                     self.EdgePassed = val < self.LimbThreshold
+                    if (self.EdgePassed):
+                        self.EdgePassedEvent.set()
                     
-                self.FrameCount = self.FrameInterval      # reset interval counter
+                # reset interval counter
+                self.FrameCount = self.EdgeFrameInterval if self.PositiveSignal else self.SearchFrameInterval
             except:
                 print("Problem framehandler")
         else:
@@ -390,7 +478,7 @@ class SHGForm(Form):
         
     # if a bump slew was requested, do 1/4 second slew at the indicated rate. Move the axis not being used for acquisition
     def DoBumpSlew(self):
-        SharpCap.Mounts.SelectedMount.MoveAxis(abs(1 - self.AxisToMove), self.BumpSlew)
+        self.moveAxis(abs(1 - self.AxisToMove), self.BumpSlew)
         time.sleep(0.25)
         self.stopSlew()
         self.BumpSlew = 0
@@ -400,41 +488,44 @@ class SHGForm(Form):
     # error out if limb not detected within 30 seconds, and reposition to rough starting position
     # returns True if edge successfully detected, False otherwise
     def SlewPastLimb(self, rate):
+        mount = SharpCap.Mounts.SelectedMount
+        cam = SharpCap.SelectedCamera
         self.EdgePassed = False
+        self.EdgePassedEvent.clear()
         self.PositiveSignal = False
-        self.FrameCount = self.FrameInterval
-        pad_rate = self.SlewFactor
-        math.copysign(pad_rate, rate)   # make padded_slew in same direction
+        self.FrameCount = self.SearchFrameInterval
+        pad_rate = math.copysign(self.SlewFactor, rate)   # make padded_slew in same direction
 
         # wait until any previous slews completed
-        while SharpCap.Mounts.SelectedMount.Slewing:
+        while mount.Slewing:
             time.sleep(0.25)
             
         # set frame handler and start time and position
-        SharpCap.SelectedCamera.FrameCaptured += self.acquireFramehandler
-        startPos = SharpCap.Mounts.SelectedMount.Coordinates
+        cam.FrameCaptured += self.acquireFramehandler
+        startPos = mount.Coordinates
         
-        SharpCap.Mounts.SelectedMount.MoveAxis(self.AxisToMove, rate)
+        self.moveAxis(self.AxisToMove, rate)
         print(f"Telescope moving at {rate:.2f}x sidereal speed...")
         while (not self.EdgePassed):     # wait until past limb or 30 seconds passed
-            endPos = SharpCap.Mounts.SelectedMount.Coordinates
+            endPos = mount.Coordinates
             if (self.AxisToMove == 0):          # slewing in RA
                 diff = abs(startPos.OffsetTo(endPos).DeltaRA)
             else:
                 diff = abs(startPos.OffsetTo(endPos).DeltaDec)
             if (self.TaskAbortFlag):
                 self.stopSlew()
-                SharpCap.SelectedCamera.FrameCaptured -= self.acquireFramehandler
+                cam.FrameCaptured -= self.acquireFramehandler
                 return False
             elif (diff >= 1):       # we've slewed more that 1 degree, so clearly something's wrong if we haven't hit solar limb yet
                 SharpCap.ShowNotification("\r*** Limb passage not detected within 1 degree ***", NotificationStatus.Error)
-                SharpCap.SelectedCamera.FrameCaptured -= self.acquireFramehandler
+                cam.FrameCaptured -= self.acquireFramehandler
                 self.stopSlew()
                 return False
+            self.EdgePassedEvent.wait(0.05)     # wakes as soon as the framehandler sees the limb
         
-        SharpCap.SelectedCamera.FrameCaptured -= self.acquireFramehandler   # unset frame handler
+        cam.FrameCaptured -= self.acquireFramehandler   # unset frame handler
         # if we've successfully detected the negative transition, slew an additional pad and resume tracking
-        SharpCap.Mounts.SelectedMount.MoveAxis(self.AxisToMove, pad_rate)
+        self.moveAxis(self.AxisToMove, pad_rate)
         time.sleep(self.SlewPad)
         self.stopSlew()
         
@@ -451,12 +542,11 @@ class SHGForm(Form):
 
         # Measure width of bright stripe in image, update sunWidth parameter
         # install framehandler, wait for result
-        self.FrameHandlingDone = False
+        self.FrameHandlingDone.clear()
         SharpCap.SelectedCamera.FrameCaptured += self.measureSunFramehandler
-        while (not self.FrameHandlingDone):
-            pass
-        self.sunWidth.Text = str(self.SunWidth)
-        self.doSunWidthChange(None, None)
+        if (not self.FrameHandlingDone.wait(timeout=5)):
+            SharpCap.ShowNotification("*** No frame received while measuring sun ***", NotificationStatus.Error)
+        self.sunWidth.Text = str(self.SunWidth)        # SunWidth already set by framehandler
         self.decenter.Text = str(self.SunDecenter)
         
         # uninstall frame handler
@@ -482,9 +572,11 @@ class SHGForm(Form):
         # enable Abort button, disable Go button
         self.enableAbort()
         self.TaskAbortFlag = False
+        self.LastMove = None        # mount may have been moved outside this script since last run
         Task.Factory.StartNew(self.DoGo)
         
     def DoGo(self):
+        cam = SharpCap.SelectedCamera
         # save start coordinates
         self.SavePos()
         
@@ -502,12 +594,12 @@ class SHGForm(Form):
             
             # Start capture
             startTime = time.time()
-            SharpCap.SelectedCamera.PrepareToCapture()
+            cam.PrepareToCapture()
             self.startCapture()
             print("Capture started...")
             self.TaskAbortFlag = not self.SlewPastLimb(self.SlewFactor)     # slew until past the limb
             # Stop capture
-            SharpCap.SelectedCamera.StopCapture()
+            cam.StopCapture()
             print("Capture stopped.")
             endTime = time.time()
             if (self.TaskAbortFlag):
@@ -518,12 +610,12 @@ class SHGForm(Form):
             else:
                 if (self.Bidirectional):
                     # capture in reverse direction
-                    SharpCap.SelectedCamera.PrepareToCapture()
+                    cam.PrepareToCapture()
                     self.startCapture()
                     print("Reverse capture started...")
                     self.TaskAbortFlag = not self.SlewPastLimb(-self.SlewFactor)
                     # Stop capture
-                    SharpCap.SelectedCamera.StopCapture()
+                    cam.StopCapture()
                     print("Capture stopped.")
 
                 # Otherwise, return at high speed
@@ -545,16 +637,18 @@ class SHGForm(Form):
         print("Completed all cycles.")
             
         # Reposition roughly over center of sun
-        SharpCap.Mounts.SelectedMount.MoveAxis(self.AxisToMove, self.SlewFactor)
+        self.moveAxis(self.AxisToMove, self.SlewFactor)
         time.sleep((endTime - startTime)/2)
         self.stopSlew()
         self.enableGo()
         
     def RestorePos(self):
-        saveRate = SharpCap.Mounts.SelectedMount.SelectedRate
-        SharpCap.Mounts.SelectedMount.SelectedRate = Interfaces.AxisRate.ForSiderealRate(REPOSITION_RATE)
-        SharpCap.Mounts.SelectedMount.SlewTo(self.SavedCoords)
-        SharpCap.Mounts.SelectedMount.SelectedRate = saveRate
+        mount = SharpCap.Mounts.SelectedMount
+        saveRate = mount.SelectedRate
+        mount.SelectedRate = Interfaces.AxisRate.ForSiderealRate(REPOSITION_RATE)
+        mount.SlewTo(self.SavedCoords)
+        self.LastMove = None
+        mount.SelectedRate = saveRate
     
     def SavePos(self):
         self.SavedCoords = SharpCap.Mounts.SelectedMount.Coordinates
@@ -563,15 +657,20 @@ class SHGForm(Form):
         self.TaskAbortFlag = True
 
     def DoAbortTask(self):
+        mount = SharpCap.Mounts.SelectedMount
+        cam = SharpCap.SelectedCamera
         # Stop any running capture, stop mount movement, return to saved position, ensure all framehandlers unset
-        if SharpCap.SelectedCamera.Capturing:
-            SharpCap.SelectedCamera.StopCapture()
-        if SharpCap.Mounts.SelectedMount.Slewing:
+        if cam.Capturing:
+            cam.StopCapture()
+        if mount.Slewing:
             self.stopSlew()
         self.RestorePos()
         self.BumpSlew = 0
-        SharpCap.SelectedCamera.FrameCaptured -= acquireFramehandler
-        SharpCap.SelectedCamera.FrameCaptured -= measureSunFramehandler
+        for handler in (self.acquireFramehandler, self.measureSunFramehandler):
+            try:
+                cam.FrameCaptured -= handler
+            except ValueError:      # pythonnet raises if the handler wasn't attached
+                pass
         self.TaskAbortFlag = False
         self.enableGo()
 
@@ -665,7 +764,7 @@ class SHGForm(Form):
         self.bumpRightFast.Size = Size(30, 20)
 
     def CalcScanParams(self):
-        # find top left corner of 100x100 box centered on capture area
+        # capture area must hold the 100x100 box used for limb detection
         cam=SharpCap.SelectedCamera
         if (cam.ROI.Width<100 or cam.ROI.Height<100):
             SharpCap.ShowNotification("*** Capture ROI must be at least 100x100 pixels ***", NotificationStatus.Error)
@@ -711,6 +810,8 @@ def launch_SHGForm():
 
     fps=MainForm.getCamFramerate()
     MainForm.frameRate.Text = f"{fps:.2f}"
+    if (fps > 0):
+        MainForm.FrameRate = fps
 
     if (MainForm.CalcScanParams()):
         Task.Factory.StartNew(MainForm.ShowDialog)
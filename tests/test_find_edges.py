@@ -0,0 +1,62 @@
+# Checks find_edges against a brute force version of the original CutROI / GetStats edge scan
+# SHGScan.py only loads inside SharpCap, so the function and its constants are pulled out of the source
+import ast, math
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+SOURCE = Path(__file__).resolve().parent.parent / "SHGScan.py"
+
+
+def load_find_edges():
+    tree = ast.parse(SOURCE.read_text())
+    keep = [node for node in tree.body
+            if (isinstance(node, ast.FunctionDef) and node.name == "find_edges")
+            or (isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "EDGE_WINDOW" for t in node.targets))]
+    ns = {"np": np, "math": math}
+    exec(compile(ast.Module(body=keep, type_ignores=[]), str(SOURCE), "exec"), ns)
+    return ns["find_edges"], ns["EDGE_WINDOW"]
+
+
+find_edges, EDGE_WINDOW = load_find_edges()
+
+
+# stddev of every EDGE_WINDOW wide window across top, first / last at or above threshold
+def brute_force_edges(top, threshold):
+    width = top.shape[1]
+    hits = [x for x in range(width - EDGE_WINDOW + 1)
+            if top[:, x:x+EDGE_WINDOW].astype(np.float64).std() >= threshold]
+    if not hits:
+        return -1, -1
+    return hits[0], hits[-1]
+
+
+def test_clean_step():
+    top = np.zeros((EDGE_WINDOW, 200), dtype=np.uint16)
+    top[:, 51:] = 1000
+    startEdge, endEdge, topStd = find_edges(top, 480)
+    assert (startEdge, endEdge) == brute_force_edges(top, 480) == (45, 47)
+    assert topStd == pytest.approx(top.astype(np.float64).std())
+
+
+def test_sun_not_in_frame():
+    top = np.full((EDGE_WINDOW, 200), 200, dtype=np.uint16)
+    startEdge, endEdge, topStd = find_edges(top, 100)
+    assert (startEdge, endEdge) == (-1, -1)
+    assert topStd == pytest.approx(0)
+
+
+def test_noisy_frames_match_brute_force():
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        width = int(rng.integers(30, 400))
+        top = rng.normal(200, 20, (EDGE_WINDOW, width))
+        start, end = sorted(rng.integers(0, width, 2))
+        top[:, start:end] += rng.uniform(200, 3000)
+        top = np.clip(top, 0, 65535).astype(np.uint16)
+        threshold = float(rng.uniform(50, 800))
+        startEdge, endEdge, topStd = find_edges(top, threshold)
+        assert (startEdge, endEdge) == brute_force_edges(top, threshold)
+        assert topStd == pytest.approx(top.astype(np.float64).std())